@@ -1,13 +1,29 @@
 import sys
 import os
+
+# Opt-in gevent mode: patch sockets/threads before anything else imports them so
+# portal requests yield during network I/O instead of holding a worker thread
+useGevent = os.getenv("USE_GEVENT") == "1"
+if useGevent:
+    from gevent import monkey
+    monkey.patch_all()
+
 import shutil
 import time
 from datetime import datetime, timedelta
-import xml.etree.ElementTree as ET
-import xml.dom.minidom as minidom
+# The XMLTV guide is built with lxml when available, xml.etree otherwise
+try:
+    from lxml import etree as ET
+    hasLxml = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    hasLxml = False
 import threading
 from threading import Thread
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 logger = logging.getLogger("MacReplay")
 logger.setLevel(logging.INFO)
 logFormat = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
@@ -24,12 +40,16 @@ fileHandler = logging.FileHandler(log_file_path)
 fileHandler.setFormatter(logFormat)
 
 
-
-logger.addHandler(fileHandler)
 consoleFormat = logging.Formatter("[%(levelname)s] %(message)s")
 consoleHandler = logging.StreamHandler()
 consoleHandler.setFormatter(consoleFormat)
-logger.addHandler(consoleHandler)
+
+# Request threads only enqueue records; a single listener thread does the file/console I/O
+logQueue = SimpleQueue()
+logger.addHandler(QueueHandler(logQueue))
+logListener = QueueListener(logQueue, fileHandler, consoleHandler, respect_handler_level=True)
+logListener.start()
+atexit.register(logListener.stop)
 
 
 # Check if running as a PyInstaller executable
@@ -53,11 +73,11 @@ if not os.path.exists(ffmpeg_path) or not os.path.exists(ffprobe_path):
 
 import flask
 from flask import Flask, jsonify
+from flask.json.provider import JSONProvider
 import stb
-import json
+import orjson
 import subprocess
 import uuid
-import xml.etree.cElementTree as ET
 from flask import (
     Flask,
     render_template,
@@ -66,13 +86,29 @@ from flask import (
     Response,
     make_response,
     flash,
+    send_file,
 )
 from datetime import datetime, timezone
 from functools import wraps
+from copy import deepcopy
+from collections import Counter, defaultdict
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 import secrets
+import shlex
+import hashlib
 import waitress
 
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = secrets.token_urlsafe(32)
 
 
@@ -99,19 +135,39 @@ os.makedirs(os.path.dirname(configFile), exist_ok=True)
 logger.info(f"Using config file: {configFile}")
 
 occupied = {}
+# occupied maps portal id -> {session id: stream info}. Streams per MAC for
+# each portal are counted alongside for O(1) lookups.
+occupied_counts = defaultdict(Counter)
+occupied_lock = threading.Lock()
 config = {}
+config_version = 0
+configDirty = threading.Event()
+configSaveLock = threading.Lock()
+portal_cache = {}
+portal_cache_lock = threading.Lock()
+portal_fetch_locks = {}
+cached_credentials = None
+credentials_version = None
+cached_fallback_index = {}
+fallback_index_version = None
 cached_lineup = []
-cached_playlist = None
-last_playlist_host = None
+ffmpegTemplate = None
+playlist_cache = {}
+playlist_lock = threading.Lock()
+xmltv_lock = threading.Lock()
 cached_xmltv = None
-last_updated = 0
+programme_store = None
 
 
-d_ffmpegcmd = [
-    "-re",                      # Flag for real-time streaming
-    "-http_proxy", "<proxy>",   # Proxy setting
-    "-timeout", "<timeout>",    # Timeout setting
-    "-i", "<url>",              # Input URL
+# Default ffmpeg arguments around the per-stream "-http_proxy/-timeout/-i" options
+_FF_HEAD = ("-re",)             # Flag for real-time streaming
+_FF_INPUT = (
+    "-avioflags", "direct",     # Skip the AVIO read buffer
+    "-flags2", "+fast",         # Allow non spec compliant speedups
+    "-max_delay", "0",          # Don't hold packets back in the demuxer
+    "-rtbufsize", "100M",       # Real-time input buffer
+)
+_FF_TAIL = (
     "-map", "0",                # Map all streams
     "-codec", "copy",           # Copy codec (no re-encoding)
     "-f", "mpegts",             # Output format
@@ -123,18 +179,26 @@ d_ffmpegcmd = [
     "-probesize", "32",         # Set probe size to reduce input analysis time
     "-copyts",                  # Copy timestamps (avoid recalculating)
     "-threads", "12",           # Enable multi-threading (adjust thread count as needed)
-    "pipe:"                     # Output to pipe
-]
-
-
-
-
+    "pipe:",                    # Output to pipe
+)
 
+# Age after which /playlist.m3u serves the cached playlist while rebuilding it
+PLAYLIST_MAX_AGE = 900  # seconds
+# How much of the end of the log file /log returns by default
+LOG_TAIL_BYTES = 512 * 1024
+# Read size for the ffmpeg stdout stream. The pipe is unbuffered, so each read
+# returns whatever is available up to this size. Reading through the pipe's file
+# object (not os.read) keeps it cooperative when gevent is in use.
+FFMPEG_READ_CHUNK = 1 << 16
+# Don't allocate a console window for ffmpeg/ffprobe on Windows
+POPEN_FLAGS = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
 
 
 defaultSettings = {
     "stream method": "ffmpeg",
-    "ffmpeg command": "-re -http_proxy <proxy> -timeout <timeout> -i <url> -map 0 -codec copy -f mpegts -flush_packets 0 -fflags +nobuffer -flags low_delay -strict experimental -analyzeduration 0 -probesize 32 -copyts -threads 12 pipe:",
+    "ffmpeg command": " ".join(
+        (*_FF_HEAD, "-http_proxy", "<proxy>", "-timeout", "<timeout>", *_FF_INPUT, "-i", "<url>", *_FF_TAIL)
+    ),
     "ffmpeg timeout": "5",
     "test streams": "true",
     "try all macs": "true",
@@ -152,6 +216,13 @@ defaultSettings = {
     "hdhr tuners": "10",
 }
 
+# Previous default ffmpeg commands, upgraded to the current default on load
+oldFfmpegCommands = (
+    "-re -http_proxy <proxy> -timeout <timeout> -i <url> -map 0 -codec copy -f mpegts -flush_packets 0 -fflags +nobuffer -flags low_delay -strict experimental -analyzeduration 0 -probesize 32 -copyts -threads 12 pipe:",
+)
+
+_MISSING = object()
+
 defaultPortal = {
     "enabled": "true",
     "name": "",
@@ -171,43 +242,69 @@ defaultPortal = {
 
 def loadConfig():
     try:
-        with open(configFile) as f:
-            data = json.load(f)
+        with open(configFile, "rb") as f:
+            data = orjson.loads(f.read())
     except:
         logger.warning("No existing config found. Creating a new one")
         data = {}
 
-    data.setdefault("portals", {})
-    data.setdefault("settings", {})
-
-    settings = data["settings"]
+    settings = data.get("settings", {})
     settingsOut = {}
 
     for setting, default in defaultSettings.items():
-        value = settings.get(setting)
-        if not value or type(default) != type(value):
-            value = default
+        value = settings.get(setting, _MISSING)
+        if value is _MISSING or not isinstance(value, type(default)):
+            value = deepcopy(default)
         settingsOut[setting] = value
 
-    data["settings"] = settingsOut
+    if settingsOut["ffmpeg command"] in oldFfmpegCommands:
+        settingsOut["ffmpeg command"] = defaultSettings["ffmpeg command"]
 
-    portals = data["portals"]
+    portals = data.get("portals", {})
     portalsOut = {}
 
     for portal in portals:
         portalsOut[portal] = {}
         for setting, default in defaultPortal.items():
-            value = portals[portal].get(setting)
-            if not value or type(default) != type(value):
-                value = default
+            value = portals[portal].get(setting, _MISSING)
+            if value is _MISSING or not isinstance(value, type(default)):
+                value = deepcopy(default)
             portalsOut[portal][setting] = value
 
-    data["portals"] = portalsOut
+    # Only rewrite the file when defaults actually had to be filled in
+    out = dict(data, settings=settingsOut, portals=portalsOut)
+    if out != data:
+        writeConfig(out)
+
+    return out
 
-    with open(configFile, "w") as f:
-        json.dump(data, f, indent=4)
 
-    return data
+def writeConfig(data):
+    # Write to a temp file and swap it in so a crash can't leave a truncated config
+    with configSaveLock:
+        tmp = configFile + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp, configFile)
+
+
+def configWriter():
+    # Coalesce bursts of saves into a single write
+    while True:
+        configDirty.wait()
+        time.sleep(0.5)
+        configDirty.clear()
+        try:
+            writeConfig(config)
+        except Exception as e:
+            logger.error(f"Failed to save config: {e}")
+            configDirty.set()
+
+
+def flushConfig():
+    if configDirty.is_set():
+        configDirty.clear()
+        writeConfig(config)
 
 
 def getPortals():
@@ -215,9 +312,10 @@ def getPortals():
 
 
 def savePortals(portals):
-    with open(configFile, "w") as f:
-        config["portals"] = portals
-        json.dump(config, f, indent=4)
+    global config_version
+    config["portals"] = portals
+    configDirty.set()
+    config_version += 1
 
 
 def getSettings():
@@ -225,21 +323,98 @@ def getSettings():
 
 
 def saveSettings(settings):
-    with open(configFile, "w") as f:
-        config["settings"] = settings
-        json.dump(config, f, indent=4)
+    global config_version
+    config["settings"] = settings
+    configDirty.set()
+    config_version += 1
+
+
+def getFfmpegTemplate():
+    # Split the configured command once and remember where the placeholders are;
+    # rebuilt only when the command is changed on the settings page
+    global ffmpegTemplate
+    command = getSettings()["ffmpeg command"]
+    if ffmpegTemplate is None or ffmpegTemplate[0] != command:
+        if "\\" in command:
+            # POSIX shlex would eat the backslashes (e.g. Windows paths), so keep
+            # the plain whitespace split such commands were written for
+            tokens = command.split()
+        else:
+            try:
+                tokens = shlex.split(command)
+            except ValueError as e:
+                # e.g. an unbalanced quote in a custom command that used to work
+                # with plain whitespace splitting
+                logger.warning(f"Could not parse ffmpeg command ({e}), splitting on whitespace")
+                tokens = command.split()
+        placeholders = [i for i, tok in enumerate(tokens) if "<" in tok]
+        ffmpegTemplate = (command, tokens, placeholders)
+    return ffmpegTemplate
+
+
+def build_ffmpeg_cmd(url, proxy, timeout):
+    _, tokens, placeholders = getFfmpegTemplate()
+    cmd = [ffmpeg_path, *tokens]
+    drop = []
+    for i in placeholders:
+        tok = tokens[i]
+        if tok == "<proxy>" and not proxy:
+            # No proxy configured: leave out "-http_proxy <proxy>" entirely
+            drop.append(i + 1)
+            if i > 0 and tokens[i - 1] == "-http_proxy":
+                drop.append(i)
+            continue
+        cmd[i + 1] = (
+            tok.replace("<url>", url)
+            .replace("<timeout>", timeout)
+            .replace("<proxy>", proxy or "")
+        )
+    for i in sorted(drop, reverse=True):
+        del cmd[i]
+    return cmd
+
+
+def makeEtag(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def getFallbackIndex():
+    # Maps a channel name to every (portal id, channel id) set up as its
+    # fallback on an enabled portal; rebuilt only after a config save
+    global cached_fallback_index, fallback_index_version
+    if fallback_index_version != config_version:
+        index = defaultdict(list)
+        portals = getPortals()
+        for portalId, portal in portals.items():
+            if portal["enabled"] == "true":
+                for fChannelId, name in portal.get("fallback channels", {}).items():
+                    index[name].append((portalId, fChannelId))
+        cached_fallback_index = dict(index)
+        fallback_index_version = config_version
+    return cached_fallback_index
+
+
+def getCredentials():
+    # Rebuilt only when the config has been saved since the last lookup
+    global cached_credentials, credentials_version
+    if credentials_version != config_version:
+        settings = getSettings()
+        cached_credentials = (
+            settings["enable security"] != "false",
+            settings["username"],
+            settings["password"],
+        )
+        credentials_version = config_version
+    return cached_credentials
 
 
 def authorise(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         auth = request.authorization
-        settings = getSettings()
-        security = settings["enable security"]
-        username = settings["username"]
-        password = settings["password"]
+        security, username, password = getCredentials()
         if (
-            security == "false"
+            not security
             or auth
             and auth.username == username
             and auth.password == password
@@ -256,13 +431,87 @@ def authorise(f):
 
 
 def moveMac(portalId, mac):
-    portals = getPortals()
-    macs = portals[portalId]["macs"]
-    x = macs[mac]
-    del macs[mac]
-    macs[mac] = x
-    portals[portalId]["macs"] = macs
-    savePortals(portals)
+    # Reordering MACs doesn't change any generated output, so only schedule a
+    # save instead of bumping config_version through savePortals
+    macs = getPortals()[portalId]["macs"]
+    macs[mac] = macs.pop(mac)
+    configDirty.set()
+
+
+def getPortalSnapshot(url, mac, proxy, ttl=300, withGenres=True):
+    # The editor, playlist, guide and lineup builders and the play path all need
+    # the same handshake and channel list, so reuse a recent fetch for the same
+    # portal/MAC. Genres are only fetched for callers that ask for them.
+    # Returns (token, allChannels, genres, channelsById).
+    key = (url, mac, proxy)
+
+    def fresh(cached):
+        return (
+            cached
+            and time.monotonic() - cached[0] < ttl
+            and (not withGenres or cached[3] is not None)
+        )
+
+    with portal_cache_lock:
+        cached = portal_cache.get(key)
+        if fresh(cached):
+            return cached[1:]
+        fetchLock = portal_fetch_locks.setdefault(key, threading.Lock())
+
+    # Only one handshake per portal/MAC at a time; concurrent callers wait for
+    # it and reuse the result instead of invalidating each other's tokens
+    with fetchLock:
+        with portal_cache_lock:
+            cached = portal_cache.get(key)
+        if fresh(cached):
+            return cached[1:]
+
+        if cached and time.monotonic() - cached[0] < ttl:
+            # Recent channels without genres: only the genres are missing
+            fetched, token, allChannels, _, channelsById = cached
+            genres = stb.StbClient(url, mac, token, proxy).getGenreNames()
+        else:
+            fetched = time.monotonic()
+            token = stb.getToken(url, mac, proxy)
+            if not token:
+                return None, None, None, None
+            client = stb.StbClient(url, mac, token, proxy)
+            client.getProfile()
+            if withGenres:
+                # The channel list and genres don't depend on each other, so overlap them
+                with ThreadPoolExecutor(max_workers=1) as ex:
+                    channelsFuture = ex.submit(client.getAllChannels)
+                    genres = client.getGenreNames()
+                    allChannels = channelsFuture.result()
+            else:
+                # None marks genres as not fetched yet
+                genres = None
+                allChannels = client.getAllChannels()
+            # Built once per snapshot so lookups by channel id don't rescan the list
+            channelsById = {str(c["id"]): c for c in allChannels} if allChannels else None
+        if allChannels:
+            with portal_cache_lock:
+                portal_cache[key] = (fetched, token, allChannels, genres, channelsById)
+        return token, allChannels, genres, channelsById
+
+
+def evictPortalSnapshot(url, mac, proxy):
+    # Drop a snapshot whose token or channel list turned out not to work
+    with portal_cache_lock:
+        portal_cache.pop((url, mac, proxy), None)
+
+
+def hasPortalSnapshot(url, mac, proxy, ttl=300):
+    # Whether getPortalSnapshot would answer from the cache instead of a new handshake
+    with portal_cache_lock:
+        cached = portal_cache.get((url, mac, proxy))
+    return bool(cached) and time.monotonic() - cached[0] < ttl
+
+
+def clearPortalSnapshots(url):
+    with portal_cache_lock:
+        for key in [k for k in portal_cache if k[0] == url]:
+            del portal_cache[key]
 
 
 @app.route("/", methods=["GET"])
@@ -280,13 +529,11 @@ def portals():
 @app.route("/portal/add", methods=["POST"])
 @authorise
 def portalsAdd():
-    global cached_xmltv
-    cached_xmltv = None
     id = uuid.uuid4().hex
     enabled = "true"
     name = request.form["name"]
     url = request.form["url"]
-    macs = list(set(request.form["macs"].split(",")))
+    macs = list(dict.fromkeys(m.strip() for m in request.form["macs"].split(",") if m.strip()))
     streamsPerMac = request.form["streams per mac"]
     epgOffset = request.form["epg offset"]
     proxy = request.form["proxy"]
@@ -301,20 +548,17 @@ def portalsAdd():
     macsd = {}
 
     for mac in macs:
-        token = stb.getToken(url, mac, proxy)
-        if token:
-            stb.getProfile(url, mac, token, proxy)
-            expiry = stb.getExpires(url, mac, token, proxy)
-            if expiry:
-                macsd[mac] = expiry
-                logger.info(
-                    "Successfully tested MAC({}) for Portal({})".format(mac, name)
-                )
-                flash(
-                    "Successfully tested MAC({}) for Portal({})".format(mac, name),
-                    "success",
-                )
-                continue
+        _, _, expiry = stb.getAccountInfo(url, mac, proxy)
+        if expiry:
+            macsd[mac] = expiry
+            logger.info(
+                "Successfully tested MAC({}) for Portal({})".format(mac, name)
+            )
+            flash(
+                "Successfully tested MAC({}) for Portal({})".format(mac, name),
+                "success",
+            )
+            continue
 
         logger.error("Error testing MAC({}) for Portal({})".format(mac, name))
         flash("Error testing MAC({}) for Portal({})".format(mac, name), "danger")
@@ -332,11 +576,12 @@ def portalsAdd():
 
         for setting, default in defaultPortal.items():
             if not portal.get(setting):
-                portal[setting] = default
+                portal[setting] = deepcopy(default)
 
         portals = getPortals()
         portals[id] = portal
         savePortals(portals)
+        Thread(target=refresh_xmltv, daemon=True).start()
         logger.info("Portal({}) added!".format(portal["name"]))
 
     else:
@@ -352,13 +597,11 @@ def portalsAdd():
 @app.route("/portal/update", methods=["POST"])
 @authorise
 def portalUpdate():
-    global cached_xmltv
-    cached_xmltv = None
     id = request.form["id"]
     enabled = request.form.get("enabled", "false")
     name = request.form["name"]
     url = request.form["url"]
-    newmacs = list(set(request.form["macs"].split(",")))
+    newmacs = list(dict.fromkeys(m.strip() for m in request.form["macs"].split(",") if m.strip()))
     streamsPerMac = request.form["streams per mac"]
     epgOffset = request.form["epg offset"]
     proxy = request.form["proxy"]
@@ -372,25 +615,24 @@ def portalUpdate():
             return redirect("/portals", code=302)
 
     portals = getPortals()
+    clearPortalSnapshots(portals[id]["url"])
+    clearPortalSnapshots(url)
     oldmacs = portals[id]["macs"]
     macsout = {}
     deadmacs = []
 
     for mac in newmacs:
         if retest or mac not in oldmacs.keys():
-            token = stb.getToken(url, mac, proxy)
-            if token:
-                stb.getProfile(url, mac, token, proxy)
-                expiry = stb.getExpires(url, mac, token, proxy)
-                if expiry:
-                    macsout[mac] = expiry
-                    logger.info(
-                        "Successfully tested MAC({}) for Portal({})".format(mac, name)
-                    )
-                    flash(
-                        "Successfully tested MAC({}) for Portal({})".format(mac, name),
-                        "success",
-                    )
+            _, _, expiry = stb.getAccountInfo(url, mac, proxy)
+            if expiry:
+                macsout[mac] = expiry
+                logger.info(
+                    "Successfully tested MAC({}) for Portal({})".format(mac, name)
+                )
+                flash(
+                    "Successfully tested MAC({}) for Portal({})".format(mac, name),
+                    "success",
+                )
 
             if mac not in list(macsout.keys()):
                 deadmacs.append(mac)
@@ -411,6 +653,7 @@ def portalUpdate():
         portals[id]["epg offset"] = epgOffset
         portals[id]["proxy"] = proxy
         savePortals(portals)
+        Thread(target=refresh_xmltv, daemon=True).start()
         logger.info("Portal({}) updated!".format(name))
         flash("Portal({}) updated!".format(name), "success")
 
@@ -430,6 +673,7 @@ def portalRemove():
     id = request.form["deleteId"]
     portals = getPortals()
     name = portals[id]["name"]
+    clearPortalSnapshots(portals[id]["url"])
     del portals[id]
     savePortals(portals)
     logger.info("Portal ({}) removed!".format(name))
@@ -447,125 +691,145 @@ def editor():
 @app.route("/editor_data", methods=["GET"])
 @authorise
 def editor_data():
-    channels = []
-    portals = getPortals()
-    for portal in portals:
+    def fetch_portal(portal):
         logger.info(f"getting Data from {portal}")
-        if portals[portal]["enabled"] == "true":
-            portalName = portals[portal]["name"]
-            url = portals[portal]["url"]
-            macs = list(portals[portal]["macs"].keys())
-            proxy = portals[portal]["proxy"]
-            enabledChannels = portals[portal].get("enabled channels", [])
-            customChannelNames = portals[portal].get("custom channel names", {})
-            customGenres = portals[portal].get("custom genres", {})
-            customChannelNumbers = portals[portal].get("custom channel numbers", {})
-            customEpgIds = portals[portal].get("custom epg ids", {})
-            fallbackChannels = portals[portal].get("fallback channels", {})
-
-            for mac in macs:
-                logger.info(f"Using mac: {mac}")
-                try:
-                    token = stb.getToken(url, mac, proxy)
-                    stb.getProfile(url, mac, token, proxy)
-                    allChannels = stb.getAllChannels(url, mac, token, proxy)
-                    genres = stb.getGenreNames(url, mac, token, proxy)
-                    break
-                except:
-                    allChannels = None
-                    genres = None
-
-            if allChannels and genres:
-                for channel in allChannels:
-                    channelId = str(channel["id"])
-                    channelName = str(channel["name"])
-                    channelNumber = str(channel["number"])
-                    genre = str(genres.get(str(channel["tv_genre_id"])))
-                    if channelId in enabledChannels:
-                        enabled = True
-                    else:
-                        enabled = False
-                    customChannelNumber = customChannelNumbers.get(channelId)
-                    if customChannelNumber == None:
-                        customChannelNumber = ""
-                    customChannelName = customChannelNames.get(channelId)
-                    if customChannelName == None:
-                        customChannelName = ""
-                    customGenre = customGenres.get(channelId)
-                    if customGenre == None:
-                        customGenre = ""
-                    customEpgId = customEpgIds.get(channelId)
-                    if customEpgId == None:
-                        customEpgId = ""
-                    fallbackChannel = fallbackChannels.get(channelId)
-                    if fallbackChannel == None:
-                        fallbackChannel = ""
-                    channels.append(
-                        {
-                            "portal": portal,
-                            "portalName": portalName,
-                            "enabled": enabled,
-                            "channelNumber": channelNumber,
-                            "customChannelNumber": customChannelNumber,
-                            "channelName": channelName,
-                            "customChannelName": customChannelName,
-                            "genre": genre,
-                            "customGenre": customGenre,
-                            "channelId": channelId,
-                            "customEpgId": customEpgId,
-                            "fallbackChannel": fallbackChannel,
-                            "link": "http://"
-                            + host
-                            + "/play/"
-                            + portal
-                            + "/"
-                            + channelId
-                            + "?web=true",
-                        }
-                    )
+        url = portals[portal]["url"]
+        macs = list(portals[portal]["macs"].keys())
+        proxy = portals[portal]["proxy"]
+
+        allChannels = None
+        genres = None
+        for mac in macs:
+            logger.info(f"Using mac: {mac}")
+            try:
+                token, allChannels, genres, _ = getPortalSnapshot(url, mac, proxy)
+                break
+            except:
+                allChannels = None
+                genres = None
+
+        if not (allChannels and genres):
+            return None
+        return allChannels, genres
+
+    def portal_rows(portal, allChannels, genres):
+        # Rows are built lazily while streaming, so only one is alive at a time
+        portalName = portals[portal]["name"]
+        enabledChannels = set(portals[portal].get("enabled channels", []))
+        customChannelNames = portals[portal].get("custom channel names", {})
+        customGenres = portals[portal].get("custom genres", {})
+        customChannelNumbers = portals[portal].get("custom channel numbers", {})
+        customEpgIds = portals[portal].get("custom epg ids", {})
+        fallbackChannels = portals[portal].get("fallback channels", {})
+
+        for channel in allChannels:
+            channelId = str(channel["id"])
+            channelName = str(channel["name"])
+            channelNumber = str(channel["number"])
+            genre = str(genres.get(str(channel["tv_genre_id"])))
+            if channelId in enabledChannels:
+                enabled = True
             else:
-                logger.error(
-                    "Error getting channel data for {}, skipping".format(portalName)
-                )
-                flash(
-                    "Error getting channel data for {}, skipping".format(portalName),
-                    "danger",
-                )
+                enabled = False
+            customChannelNumber = customChannelNumbers.get(channelId)
+            if customChannelNumber == None:
+                customChannelNumber = ""
+            customChannelName = customChannelNames.get(channelId)
+            if customChannelName == None:
+                customChannelName = ""
+            customGenre = customGenres.get(channelId)
+            if customGenre == None:
+                customGenre = ""
+            customEpgId = customEpgIds.get(channelId)
+            if customEpgId == None:
+                customEpgId = ""
+            fallbackChannel = fallbackChannels.get(channelId)
+            if fallbackChannel == None:
+                fallbackChannel = ""
+            yield {
+                "portal": portal,
+                "portalName": portalName,
+                "enabled": enabled,
+                "channelNumber": channelNumber,
+                "customChannelNumber": customChannelNumber,
+                "channelName": channelName,
+                "customChannelName": customChannelName,
+                "genre": genre,
+                "customGenre": customGenre,
+                "channelId": channelId,
+                "customEpgId": customEpgId,
+                "fallbackChannel": fallbackChannel,
+                "link": "http://"
+                + host
+                + "/play/"
+                + portal
+                + "/"
+                + channelId
+                + "?web=true",
+            }
 
-    data = {"data": channels}
+    portals = getPortals()
+    enabledPortals = [p for p in portals if portals[p]["enabled"] == "true"]
+
+    # Portal requests are pure network I/O, so fetch them side by side. The
+    # results are the snapshot's own channel lists, so holding them costs nothing
+    # extra; failures are flashed here, before the response starts.
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(enabledPortals)))) as ex:
+        results = list(ex.map(fetch_portal, enabledPortals))
+
+    working = []
+    for portal, result in zip(enabledPortals, results):
+        if result is not None:
+            working.append((portal, *result))
+        else:
+            portalName = portals[portal]["name"]
+            logger.error(
+                "Error getting channel data for {}, skipping".format(portalName)
+            )
+            flash(
+                "Error getting channel data for {}, skipping".format(portalName),
+                "danger",
+            )
 
-    return flask.jsonify(data)
+    # Stream {"data": [...]} a portal at a time, building and serialising the
+    # row dicts on the fly instead of keeping them all in memory
+    def generate():
+        yield b'{"data":['
+        first = True
+        for portal, allChannels, genres in working:
+            chunk = b",".join(orjson.dumps(row) for row in portal_rows(portal, allChannels, genres))
+            if not chunk:
+                continue
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b"]}"
+
+    return Response(generate(), mimetype="application/json")
 
 
 @app.route("/editor/save", methods=["POST"])
 @authorise
 def editorSave():
-    global cached_xmltv, last_playlist_host
-    # clear the xmltv cache so the tv guide will be updated next time it's requested
-    cached_xmltv = None
-    # clear the playlist host cache so a changed host will regenerate the playlist
-    last_playlist_host = None
-    # Force update in separate daemon threads so the HTTP request can return immediately
-    threading.Thread(target=refresh_xmltv, daemon=True).start()
-    Thread(target=refresh_lineup, daemon=True).start()
-    enabledEdits = json.loads(request.form["enabledEdits"])
-    numberEdits = json.loads(request.form["numberEdits"])
-    nameEdits = json.loads(request.form["nameEdits"])
-    genreEdits = json.loads(request.form["genreEdits"])
-    epgEdits = json.loads(request.form["epgEdits"])
-    fallbackEdits = json.loads(request.form["fallbackEdits"])
+    enabledEdits = orjson.loads(request.form["enabledEdits"])
+    numberEdits = orjson.loads(request.form["numberEdits"])
+    nameEdits = orjson.loads(request.form["nameEdits"])
+    genreEdits = orjson.loads(request.form["genreEdits"])
+    epgEdits = orjson.loads(request.form["epgEdits"])
+    fallbackEdits = orjson.loads(request.form["fallbackEdits"])
     portals = getPortals()
+    enabledSets = {}
     for edit in enabledEdits:
         portal = edit["portal"]
         channelId = edit["channel id"]
         enabled = edit["enabled"]
+        if portal not in enabledSets:
+            enabledSets[portal] = set(portals[portal].get("enabled channels", []))
         if enabled:
-            portals[portal].setdefault("enabled channels", [])
-            portals[portal]["enabled channels"].append(channelId)
+            enabledSets[portal].add(channelId)
         else:
-            portals[portal]["enabled channels"] = list(
-                filter((channelId).__ne__, portals[portal]["enabled channels"])
-            )
+            enabledSets[portal].discard(channelId)
+    for portal, enabledChannels in enabledSets.items():
+        portals[portal]["enabled channels"] = list(enabledChannels)
 
     for edit in numberEdits:
         portal = edit["portal"]
@@ -618,6 +882,10 @@ def editorSave():
             portals[portal]["fallback channels"].pop(channelId)
 
     savePortals(portals)
+    # Rebuild the guide and lineup from the saved config in the background; the
+    # previous guide keeps being served until the new one is in place
+    Thread(target=refresh_xmltv, daemon=True).start()
+    Thread(target=refresh_lineup, daemon=True).start()
     logger.info("Playlist config saved!")
     flash("Playlist config saved!", "success")
     return redirect("/editor", code=302)
@@ -669,299 +937,427 @@ def save():
 @app.route("/playlist.m3u", methods=["GET"])
 @authorise
 def playlist():
-    global cached_playlist, last_playlist_host
-    
     logger.info("Playlist Requested")
     
     # Detect the current host dynamically
     current_host = request.host or "127.0.0.1"
     
-    # Regenerate the playlist if it is empty or the host has changed
-    if cached_playlist is None or len(cached_playlist) == 0 or last_playlist_host != current_host:
-        logger.info(f"Regenerating playlist due to host change: {last_playlist_host} -> {current_host}")
-        last_playlist_host = current_host
-        generate_playlist()
-
-    return Response(cached_playlist, mimetype="text/plain")
+    # Playlists are cached per host and config version, so clients reaching the
+    # server under different hosts don't evict each other
+    key = (current_host, config_version)
+    cached_playlist = playlist_cache.get(key)
+    if cached_playlist is None:
+        # Cold cache or the config changed: build now so the response reflects
+        # the latest save. Only the first request builds, the others wait for it.
+        with playlist_lock:
+            cached_playlist = playlist_cache.get(key)
+            if cached_playlist is None:
+                logger.info(f"Generating playlist for host {current_host}")
+                cached_playlist = generate_playlist(current_host)
+    elif time.monotonic() - cached_playlist[2] > PLAYLIST_MAX_AGE:
+        # Same config, just old: serve it while one rebuild runs in the background
+        if playlist_lock.acquire(blocking=False):
+            logger.info(f"Rebuilding playlist for host {current_host} in the background")
+            Thread(target=rebuild_playlist, args=(current_host,), daemon=True).start()
+
+    # Answer polling clients that already have this version with a 304
+    body, etag, _ = cached_playlist
+    response = Response(body, mimetype="text/plain; charset=utf-8")
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 # Function to manually trigger playlist update
 @app.route("/update_playlistm3u", methods=["POST"])
 def update_playlistm3u():
-    generate_playlist()
+    with playlist_lock:
+        generate_playlist(request.host or "127.0.0.1")
     return Response("Playlist updated successfully", status=200)
 
-def generate_playlist():
-    global cached_playlist
+def rebuild_playlist(playlist_host):
+    # Runs with playlist_lock already acquired by the caller
+    try:
+        generate_playlist(playlist_host)
+    except Exception as e:
+        logger.error(f"Failed to rebuild playlist: {e}")
+    finally:
+        playlist_lock.release()
+
+def generate_playlist(playlist_host):
     logger.info("Generating playlist.m3u...")
+    version = config_version
+
+    # Resolve the playlist toggles once instead of per channel
+    settings = getSettings()
+    use_nums = settings.get("use channel numbers", "true") == "true"
+    use_genres = settings.get("use channel genres", "true") == "true"
+    sort_name = settings.get("sort playlist by channel name", "true") == "true"
+    sort_num = use_nums and settings.get("sort playlist by channel number", "false") == "true"
+    sort_genre = use_genres and settings.get("sort playlist by channel genre", "false") == "true"
+
+    def fetch_portal(portal):
+        enabledChannels = set(portals[portal].get("enabled channels", []))
+        name = portals[portal]["name"]
+        url = portals[portal]["url"]
+        macs = list(portals[portal]["macs"].keys())
+        proxy = portals[portal]["proxy"]
+        customChannelNames = portals[portal].get("custom channel names", {})
+        customGenres = portals[portal].get("custom genres", {})
+        customChannelNumbers = portals[portal].get("custom channel numbers", {})
+        customEpgIds = portals[portal].get("custom epg ids", {})
+
+        allChannels = None
+        genres = None
+        for mac in macs:
+            try:
+                token, allChannels, genres, _ = getPortalSnapshot(url, mac, proxy)
+                break
+            except:
+                allChannels = None
+                genres = None
+
+        if not (allChannels and genres):
+            logger.error("Error making playlist for {}, skipping".format(name))
+            return []
+
+        entries = []
+        for channel in allChannels:
+            channelId = str(channel.get("id"))
+            if channelId in enabledChannels:
+                channelName = customChannelNames.get(channelId)
+                if channelName is None:
+                    channelName = str(channel.get("name"))
+                genre = customGenres.get(channelId)
+                if genre is None:
+                    genreId = str(channel.get("tv_genre_id"))
+                    genre = str(genres.get(genreId))
+                channelNumber = customChannelNumbers.get(channelId)
+                if channelNumber is None:
+                    channelNumber = str(channel.get("number"))
+                epgId = customEpgIds.get(channelId)
+                if epgId is None:
+                    epgId = channelName
+                chno_part = f' tvg-chno="{channelNumber}"' if use_nums else ""
+                grp_part = f' group-title="{genre}"' if use_genres else ""
+                entries.append(
+                    (
+                        channelName,
+                        channelNumber,
+                        genre,
+                        f'#EXTINF:-1 tvg-id="{epgId}"{chno_part}{grp_part},{channelName}\n'
+                        f"http://{playlist_host}/play/{portal}/{channelId}",
+                    )
+                )
+        return entries
 
-    # Detect the host dynamically from the request
-    playlist_host = request.host or "127.0.0.1"
-    
     channels = []
     portals = getPortals()
-
-    for portal in portals:
-        if portals[portal]["enabled"] == "true":
-            enabledChannels = portals[portal].get("enabled channels", [])
-            if len(enabledChannels) != 0:
-                name = portals[portal]["name"]
-                url = portals[portal]["url"]
-                macs = list(portals[portal]["macs"].keys())
-                proxy = portals[portal]["proxy"]
-                customChannelNames = portals[portal].get("custom channel names", {})
-                customGenres = portals[portal].get("custom genres", {})
-                customChannelNumbers = portals[portal].get("custom channel numbers", {})
-                customEpgIds = portals[portal].get("custom epg ids", {})
-
-                for mac in macs:
-                    try:
-                        token = stb.getToken(url, mac, proxy)
-                        stb.getProfile(url, mac, token, proxy)
-                        allChannels = stb.getAllChannels(url, mac, token, proxy)
-                        genres = stb.getGenreNames(url, mac, token, proxy)
-                        break
-                    except:
-                        allChannels = None
-                        genres = None
-
-                if allChannels and genres:
-                    for channel in allChannels:
-                        channelId = str(channel.get("id"))
-                        if channelId in enabledChannels:
-                            channelName = customChannelNames.get(channelId)
-                            if channelName is None:
-                                channelName = str(channel.get("name"))
-                            genre = customGenres.get(channelId)
-                            if genre is None:
-                                genreId = str(channel.get("tv_genre_id"))
-                                genre = str(genres.get(genreId))
-                            channelNumber = customChannelNumbers.get(channelId)
-                            if channelNumber is None:
-                                channelNumber = str(channel.get("number"))
-                            epgId = customEpgIds.get(channelId)
-                            if epgId is None:
-                                epgId = channelName
-                            channels.append(
-                                "#EXTINF:-1"
-                                + ' tvg-id="'
-                                + epgId
-                                + (
-                                    '" tvg-chno="' + channelNumber
-                                    if getSettings().get("use channel numbers", "true")
-                                    == "true"
-                                    else ""
-                                )
-                                + (
-                                    '" group-title="' + genre
-                                    if getSettings().get("use channel genres", "true")
-                                    == "true"
-                                    else ""
-                                )
-                                + '",'
-                                + channelName
-                                + "\n"
-                                + "http://"
-                                + playlist_host  # Use the dynamically detected playlist host
-                                + "/play/"
-                                + portal
-                                + "/"
-                                + channelId
-                            )
-                else:
-                    logger.error("Error making playlist for {}, skipping".format(name))
-
-    # Sorting the playlist based on settings
-    if getSettings().get("sort playlist by channel name", "true") == "true":
-        channels.sort(key=lambda k: k.split(",")[1].split("\n")[0])
-    if getSettings().get("use channel numbers", "true") == "true":
-        if getSettings().get("sort playlist by channel number", "false") == "true":
-            channels.sort(key=lambda k: k.split('tvg-chno="')[1].split('"')[0])
-    if getSettings().get("use channel genres", "true") == "true":
-        if getSettings().get("sort playlist by channel genre", "false") == "true":
-            channels.sort(key=lambda k: k.split('group-title="')[1].split('"')[0])
-
-    playlist = "#EXTM3U \n"
-    playlist = playlist + "\n".join(channels)
-
-    # Update the cache
-    cached_playlist = playlist
+    activePortals = [
+        p
+        for p in portals
+        if portals[p]["enabled"] == "true"
+        and len(portals[p].get("enabled channels", [])) != 0
+    ]
+
+    # Fetch every portal concurrently; results keep the portal order
+    with ThreadPoolExecutor(max_workers=max(1, min(16, len(activePortals)))) as ex:
+        for entries in ex.map(fetch_portal, activePortals):
+            channels.extend(entries)
+
+    # Sorting the playlist based on settings. Entries are (name, number, genre, line)
+    # tuples and the sorts are stable, so the last one applied takes priority.
+    if sort_name:
+        channels.sort(key=itemgetter(0))
+    if sort_num:
+        channels.sort(key=itemgetter(1))
+    if sort_genre:
+        channels.sort(key=itemgetter(2))
+
+    playlist = "#EXTM3U \n" + "\n".join(entry[3] for entry in channels)
+
+    # Update the cache, pre-encoded so each request serves the bytes as-is.
+    # Entries from older config versions can never be hit again.
+    playlist_bytes = playlist.encode("utf-8")
+    cached_playlist = (playlist_bytes, makeEtag(playlist_bytes), time.monotonic())
+    for key in [k for k in playlist_cache if k[1] != version]:
+        playlist_cache.pop(key, None)
+    playlist_cache[(playlist_host, version)] = cached_playlist
     logger.info("Playlist generated and cached.")
+    return cached_playlist
     
-def refresh_xmltv():
-    settings = getSettings()
-    logger.info("Refreshing XMLTV...")
+def replaceFile(src, dst, attempts=10, delay=0.2):
+    # On Windows os.replace fails while another handle (e.g. a guide download
+    # via send_file) still has dst open, so retry for a moment before giving up
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+
+
+def _fmt_epoch(ts):
+    # XMLTV timestamp (YYYYmmddHHMMSS +0000) without going through datetime/strftime.
+    # Callers apply the portal's EPG offset to ts beforehand.
+    t = time.gmtime(ts)
+    return f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d} +0000"
+
 
+def getXmltvCacheFile():
     # Set up paths for XMLTV cache
     user_dir = os.path.expanduser("~")
     cache_dir = os.path.join(user_dir, "Evilvir.us")
     os.makedirs(cache_dir, exist_ok=True)
-    cache_file = os.path.join(cache_dir, "MacReplayEPG.xml")
+    return os.path.join(cache_dir, "MacReplayEPG.xml")
 
-    # Define date cutoff for programme filtering
-    day_before_yesterday = datetime.utcnow() - timedelta(days=2)
-    day_before_yesterday_str = day_before_yesterday.strftime("%Y%m%d%H%M%S") + " +0000"
 
-    # Load existing cache if it exists
-    cached_programmes = []
-    if os.path.exists(cache_file):
-        try:
-            tree = ET.parse(cache_file)
-            root = tree.getroot()
-            for programme in root.findall("programme"):
-                stop_attr = programme.get("stop")  # Get the 'stop' attribute
-                if stop_attr:
-                    try:
-                        # Parse the stop time and compare with the cutoff
-                        stop_time = datetime.strptime(stop_attr.split(" ")[0], "%Y%m%d%H%M%S")
-                        if stop_time >= day_before_yesterday:  # Keep only recent programmes
-                            cached_programmes.append(ET.tostring(programme, encoding="unicode"))
-                    except ValueError as e:
-                        logger.warning(f"Invalid stop time format in cached programme: {stop_attr}. Skipping.")
-            logger.info("Loaded existing programme data from cache.")
-        except Exception as e:
-            logger.error(f"Failed to load cache file: {e}")
+def build_xmltv():
+    # Callers must hold xmltv_lock; use refresh_xmltv() otherwise
+    settings = getSettings()
+    logger.info("Refreshing XMLTV...")
 
-    # Initialize new XMLTV data
-    channels = ET.Element("tv")
-    programmes = ET.Element("tv")
-    portals = getPortals()
+    cache_file = getXmltvCacheFile()
 
-    for portal in portals:
-        if portals[portal]["enabled"] == "true":
-            portal_name = portals[portal]["name"]
-            portal_epg_offset = int(portals[portal]["epg offset"])
-            logger.info(f"Fetching EPG | Portal: {portal_name} | offset: {portal_epg_offset} |")
-
-            enabledChannels = portals[portal].get("enabled channels", [])
-            if len(enabledChannels) != 0:
-                name = portals[portal]["name"]
-                url = portals[portal]["url"]
-                macs = list(portals[portal]["macs"].keys())
-                proxy = portals[portal]["proxy"]
-                customChannelNames = portals[portal].get("custom channel names", {})
-                customEpgIds = portals[portal].get("custom epg ids", {})
-                customChannelNumbers = portals[portal].get("custom channel numbers", {})
-
-                for mac in macs:
-                    try:
-                        token = stb.getToken(url, mac, proxy)
-                        stb.getProfile(url, mac, token, proxy)
-                        allChannels = stb.getAllChannels(url, mac, token, proxy)
-                        epg = stb.getEpg(url, mac, token, 24, proxy)
-                        break
-                    except Exception as e:
-                        allChannels = None
-                        epg = None
-                        logger.error(f"Error fetching data for MAC {mac}: {e}")
-
-                if allChannels and epg:
-                    for channel in allChannels:
-                        try:
-                            channelId = str(channel.get("id"))
-                            if str(channelId) in enabledChannels:
-                                channelName = customChannelNames.get(channelId, channel.get("name"))
-                                channelNumber = customChannelNumbers.get(channelId, str(channel.get("number")))
-                                epgId = customEpgIds.get(channelId, channelNumber)
-
-                                channelEle = ET.SubElement(
-                                    channels, "channel", id=epgId
-                                )
-                                ET.SubElement(channelEle, "display-name").text = channelName
-                                ET.SubElement(channelEle, "icon", src=channel.get("logo"))
-
-                                if channelId not in epg or not epg.get(channelId):
-                                    logger.warning(f"No EPG data found for channel {channelName} (ID: {channelId}), Creating a Dummy EPG item.")
-                                    start_time = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
-                                    stop_time = start_time + timedelta(hours=24)
-                                    start = start_time.strftime("%Y%m%d%H%M%S") + " +0000"
-                                    stop = stop_time.strftime("%Y%m%d%H%M%S") + " +0000"
-                                    programmeEle = ET.SubElement(
-                                        programmes,
-                                        "programme",
-                                        start=start,
-                                        stop=stop,
-                                        channel=epgId,
-                                    )
-                                    ET.SubElement(programmeEle, "title").text = channelName
-                                    ET.SubElement(programmeEle, "desc").text = channelName
-                                else:
-                                    for p in epg.get(channelId):
-                                        try:
-                                            start_time = datetime.utcfromtimestamp(p.get("start_timestamp")) + timedelta(hours=portal_epg_offset)
-                                            stop_time = datetime.utcfromtimestamp(p.get("stop_timestamp")) + timedelta(hours=portal_epg_offset)
-                                            start = start_time.strftime("%Y%m%d%H%M%S") + " +0000"
-                                            stop = stop_time.strftime("%Y%m%d%H%M%S") + " +0000"
-                                            if start <= day_before_yesterday_str:
-                                                continue
-                                            programmeEle = ET.SubElement(
-                                                programmes,
-                                                "programme",
-                                                start=start,
-                                                stop=stop,
-                                                channel=epgId,
-                                            )
-                                            ET.SubElement(programmeEle, "title").text = p.get("name")
-                                            ET.SubElement(programmeEle, "desc").text = p.get("descr")
-                                        except Exception as e:
-                                            logger.error(f"Error processing programme for channel {channelName} (ID: {channelId}): {e}")
-                                            pass
-                        except Exception as e:
-                            logger.error(f"| Channel:{channelNumber} | {channelName} | {e}")
-                            pass
+    # Define date cutoff for programme filtering
+    day_before_yesterday = datetime.utcnow() - timedelta(days=2)
+    cutoff_int = int(day_before_yesterday.strftime("%Y%m%d%H%M%S"))
+    cutoff_ts = time.time() - 2 * 86400
+
+    def is_recent(programme):
+        stop_attr = programme.get("stop")  # Get the 'stop' attribute
+        if stop_attr:
+            try:
+                # Compare the YYYYmmddHHMMSS stop time with the cutoff as an integer
+                return int(stop_attr[:14]) >= cutoff_int
+            except ValueError as e:
+                logger.warning(f"Invalid stop time format in cached programme: {stop_attr}. Skipping.")
+        return False
+
+    # Reuse the programmes from the previous build; the cache file is only parsed
+    # once, on the first refresh after startup
+    global programme_store
+    if programme_store is not None:
+        cached_programmes = [p for p in programme_store if is_recent(p)]
+    else:
+        cached_programmes = []
+        if os.path.exists(cache_file):
+            try:
+                # Stream the file and drop processed elements so the whole guide is never in memory
+                root = None
+                if hasLxml:
+                    # Drop the old indentation so pretty_print can lay the merged tree out again
+                    events = ET.iterparse(cache_file, events=("start", "end"), remove_blank_text=True)
                 else:
-                    logger.error(f"Error making XMLTV for {name}, skipping")
+                    events = ET.iterparse(cache_file, events=("start", "end"))
+                for event, programme in events:
+                    if root is None:
+                        root = programme
+                    if event != "end" or programme.tag != "programme":
+                        continue
+                    if is_recent(programme):  # Keep only recent programmes
+                        cached_programmes.append(programme)
+                    root.clear()
+                logger.info("Loaded existing programme data from cache.")
+            except Exception as e:
+                logger.error(f"Failed to load cache file: {e}")
 
-    # Combine channels and programmes into a single XML document
-    xmltv = channels
-    for programme in programmes.iter("programme"):
-        xmltv.append(programme)
+    # Initialize new XMLTV data
+    xmltv = ET.Element("tv")
+    portals = getPortals()
 
-    # Add cached programmes, ensuring no duplicates
-    existing_programme_hashes = {ET.tostring(p, encoding="unicode") for p in xmltv.findall("programme")}
+    def fetch_portal(portal):
+        # Runs in a worker thread and returns plain tuples; the elements are
+        # built on the calling thread so lxml trees never cross threads.
+        portal_name = portals[portal]["name"]
+        portal_epg_offset = int(portals[portal]["epg offset"])
+        offset_s = portal_epg_offset * 3600
+        logger.info(f"Fetching EPG | Portal: {portal_name} | offset: {portal_epg_offset} |")
+
+        enabledChannels = set(portals[portal].get("enabled channels", []))
+        name = portals[portal]["name"]
+        url = portals[portal]["url"]
+        macs = list(portals[portal]["macs"].keys())
+        proxy = portals[portal]["proxy"]
+        customChannelNames = portals[portal].get("custom channel names", {})
+        customEpgIds = portals[portal].get("custom epg ids", {})
+        customChannelNumbers = portals[portal].get("custom channel numbers", {})
+
+        allChannels = None
+        epg = None
+        for mac in macs:
+            try:
+                token, allChannels, _, _ = getPortalSnapshot(url, mac, proxy, withGenres=False)
+                epg = stb.getEpg(url, mac, token, 24, proxy)
+                break
+            except Exception as e:
+                allChannels = None
+                epg = None
+                logger.error(f"Error fetching data for MAC {mac}: {e}")
+
+        if not (allChannels and epg):
+            logger.error(f"Error making XMLTV for {name}, skipping")
+            return [], []
+
+        channelRows = []
+        programmeRows = []
+        for channel in allChannels:
+            try:
+                channelId = str(channel.get("id"))
+                if str(channelId) in enabledChannels:
+                    channelName = customChannelNames.get(channelId, channel.get("name"))
+                    channelNumber = customChannelNumbers.get(channelId, str(channel.get("number")))
+                    epgId = customEpgIds.get(channelId, channelNumber)
+                    channelRows.append((epgId, channelName, channel.get("logo")))
+
+                    if channelId not in epg or not epg.get(channelId):
+                        logger.warning(f"No EPG data found for channel {channelName} (ID: {channelId}), Creating a Dummy EPG item.")
+                        start_time = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+                        stop_time = start_time + timedelta(hours=24)
+                        start = start_time.strftime("%Y%m%d%H%M%S") + " +0000"
+                        stop = stop_time.strftime("%Y%m%d%H%M%S") + " +0000"
+                        programmeRows.append((start, stop, epgId, channelName, channelName))
+                    else:
+                        for p in epg.get(channelId):
+                            try:
+                                # Drop old programmes on the raw timestamp before any formatting
+                                start_ts = p.get("start_timestamp") + offset_s
+                                if start_ts <= cutoff_ts:
+                                    continue
+                                start = _fmt_epoch(start_ts)
+                                stop = _fmt_epoch(p.get("stop_timestamp") + offset_s)
+                                programmeRows.append((start, stop, epgId, p.get("name"), p.get("descr")))
+                            except Exception as e:
+                                logger.error(f"Error processing programme for channel {channelName} (ID: {channelId}): {e}")
+                                pass
+            except Exception as e:
+                logger.error(f"| Channel:{channelNumber} | {channelName} | {e}")
+                pass
+        return channelRows, programmeRows
+
+    activePortals = [
+        p
+        for p in portals
+        if portals[p]["enabled"] == "true"
+        and len(portals[p].get("enabled channels", [])) != 0
+    ]
+
+    # Fetch every portal concurrently; results keep the portal order
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(activePortals)))) as ex:
+        results = list(ex.map(fetch_portal, activePortals))
+
+    # Channels and programmes go straight into the one root; every channel
+    # comes before the first programme as XMLTV expects
+    for channelRows, _ in results:
+        for epgId, channelName, logo in channelRows:
+            try:
+                channelEle = ET.SubElement(xmltv, "channel", id=epgId)
+                ET.SubElement(channelEle, "display-name").text = channelName
+                if logo:
+                    ET.SubElement(channelEle, "icon", src=logo)
+            except Exception as e:
+                logger.error(f"| Channel:{epgId} | {channelName} | {e}")
+    for _, programmeRows in results:
+        for start, stop, epgId, title, desc in programmeRows:
+            try:
+                programmeEle = ET.SubElement(
+                    xmltv,
+                    "programme",
+                    start=start,
+                    stop=stop,
+                    channel=epgId,
+                )
+                ET.SubElement(programmeEle, "title").text = title
+                ET.SubElement(programmeEle, "desc").text = desc
+            except Exception as e:
+                logger.error(f"Error processing programme for channel {epgId}: {e}")
+
+    # Add cached programmes, ensuring no duplicates. A programme is identified by
+    # its channel, start, stop and title rather than its serialised XML.
+    def programme_key(p):
+        return (p.get("channel"), p.get("start"), p.get("stop"), p.findtext("title") or "")
+
+    seen = {programme_key(p) for p in xmltv.iter("programme")}
+    kept = []
     for cached in cached_programmes:
-        if cached not in existing_programme_hashes:
-            xmltv.append(ET.fromstring(cached))
-
-    # Pretty-print the XML with blank line removal
-    rough_string = ET.tostring(xmltv, encoding="unicode")
-    reparsed = minidom.parseString(rough_string)
-    formatted_xmltv = "\n".join([line for line in reparsed.toprettyxml(indent="  ").splitlines() if line.strip()])
-
-    # Save updated cache
-    with open(cache_file, "w", encoding="utf-8") as f:
-        f.write(formatted_xmltv)
+        key = programme_key(cached)
+        if key not in seen:
+            seen.add(key)
+            kept.append(cached)
+    xmltv.extend(kept)
+
+    programmes = list(xmltv.iter("programme"))
+
+    # Save updated cache, serialising element by element so the whole guide
+    # never exists as one string in memory. Written to a temp file and swapped
+    # in so /xmltv never serves a half-written guide.
+    tmp_file = cache_file + ".tmp"
+    try:
+        if hasLxml:
+            with ET.xmlfile(tmp_file, encoding="utf-8") as xf:
+                xf.write_declaration()
+                with xf.element("tv"):
+                    xf.write("\n")
+                    for element in xmltv:
+                        xf.write(element, pretty_print=True)
+        else:
+            ET.indent(xmltv)
+            ET.ElementTree(xmltv).write(tmp_file, encoding="utf-8", xml_declaration=True)
+        replaceFile(tmp_file, cache_file)
+    except OSError as e:
+        # Keep serving the previous guide; the next refresh tries again
+        logger.error(f"Failed to update XMLTV cache: {e}")
+        return
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    programme_store = programmes
     logger.info("XMLTV cache updated.")
 
-    # Update global cache
-    global cached_xmltv, last_updated
-    cached_xmltv = formatted_xmltv
-    last_updated = time.time()
-    logger.debug(f"Generated XMLTV: {formatted_xmltv}")
+    # The /xmltv route serves the cache file directly
+    global cached_xmltv
+    cached_xmltv = cache_file
+    logger.debug("Generated XMLTV: %s", cache_file)
     
+def refresh_xmltv():
+    # Only one guide build runs at a time, whether from the scheduler, a
+    # settings save or the editor
+    with xmltv_lock:
+        build_xmltv()
+
 # Endpoint to get the XMLTV data
 @app.route("/xmltv", methods=["GET"])
 @authorise
 def xmltv():
-    global cached_xmltv, last_updated
     logger.info("Guide Requested")
     
-    # Check if the cached XMLTV data is older than 15 minutes
-    if cached_xmltv is None or (time.time() - last_updated) > 900:  # 900 seconds = 15 minutes
-        refresh_xmltv()
-    
-    return Response(
-        cached_xmltv,
-        mimetype="text/xml",
-    )
+    # Read the global once; a concurrent refresh may replace it at any time
+    guide = cached_xmltv
+    if guide is None:
+        cache_file = getXmltvCacheFile()
+        if os.path.exists(cache_file):
+            # Not built by this process yet (or the last build failed): serve the
+            # guide left on disk while the scheduler refreshes it
+            guide = cache_file
+        else:
+            # No guide at all: only the first request builds, the others wait for it
+            with xmltv_lock:
+                if cached_xmltv is None:
+                    build_xmltv()
+            guide = cached_xmltv
+    if guide is None:
+        return make_response("Guide not available yet", 503)
+
+    # send_file handles the ETag, 304s and range requests from the file on disk
+    return send_file(guide, mimetype="text/xml", conditional=True)
 
 
 @app.route("/play/<portalId>/<channelId>", methods=["GET"])
 def channel(portalId, channelId):
     def streamData():
         def occupy():
-            occupied.setdefault(portalId, [])
-            occupied.get(portalId, []).append(
-                {
+            with occupied_lock:
+                occupied.setdefault(portalId, {})[sessionId] = {
                     "mac": mac,
                     "channel id": channelId,
                     "channel name": channelName,
@@ -969,22 +1365,19 @@ def channel(portalId, channelId):
                     "portal name": portalName,
                     "start time": startTime,
                 }
-            )
+                occupied_counts[portalId][mac] += 1
             logger.info("Occupied Portal({}):MAC({})".format(portalId, mac))
 
         def unoccupy():
-            occupied.get(portalId, []).remove(
-                {
-                    "mac": mac,
-                    "channel id": channelId,
-                    "channel name": channelName,
-                    "client": ip,
-                    "portal name": portalName,
-                    "start time": startTime,
-                }
-            )
+            with occupied_lock:
+                if occupied.get(portalId, {}).pop(sessionId, None) is None:
+                    return
+                occupied_counts[portalId][mac] -= 1
+                if occupied_counts[portalId][mac] <= 0:
+                    del occupied_counts[portalId][mac]
             logger.info("Unoccupied Portal({}):MAC({})".format(portalId, mac))
 
+        sessionId = uuid.uuid4().hex
         try:
             startTime = datetime.now(timezone.utc).timestamp()
             occupy()
@@ -993,10 +1386,13 @@ def channel(portalId, channelId):
                 stdin=subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.DEVNULL,
+                bufsize=0,
+                creationflags=POPEN_FLAGS,
             ) as ffmpeg_sp:
+                read = ffmpeg_sp.stdout.read
                 while True:
-                    chunk = ffmpeg_sp.stdout.read(1024)
-                    if len(chunk) == 0:
+                    chunk = read(FFMPEG_READ_CHUNK)
+                    if chunk == b"":
                         if ffmpeg_sp.poll() != 0:
                             logger.info("Ffmpeg closed with error({}). Moving MAC({}) for Portal({})".format(str(ffmpeg_sp.poll()), mac, portalName))
                             moveMac(portalId, mac)
@@ -1009,8 +1405,7 @@ def channel(portalId, channelId):
             ffmpeg_sp.kill()
 
     def testStream():
-        timeout = int(getSettings()["ffmpeg timeout"]) * int(1000000)
-        ffprobecmd = [ffprobe_path, "-timeout", str(timeout), "-i", link]
+        ffprobecmd = [ffprobe_path, "-timeout", ffmpegTimeout, "-i", link]
 
         if proxy:
             ffprobecmd.insert(1, "-http_proxy")
@@ -1021,6 +1416,7 @@ def channel(portalId, channelId):
             stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
+            creationflags=POPEN_FLAGS,
         ) as ffprobe_sb:
             ffprobe_sb.communicate()
             if ffprobe_sb.returncode == 0:
@@ -1029,16 +1425,14 @@ def channel(portalId, channelId):
                 return False
 
     def isMacFree():
-        count = 0
-        for i in occupied.get(portalId, []):
-            if i["mac"] == mac:
-                count = count + 1
-        if count < streamsPerMac:
-            return True
-        else:
-            return False
+        with occupied_lock:
+            return occupied_counts[portalId][mac] < streamsPerMac
 
-    portal = getPortals().get(portalId)
+    # Read the config once for the whole request
+    settings = getSettings()
+    portals = getPortals()
+    ffmpegTimeout = str(int(settings["ffmpeg timeout"]) * int(1000000))
+    portal = portals.get(portalId)
     portalName = portal.get("name")
     url = portal.get("url")
     macs = list(portal["macs"].keys())
@@ -1051,21 +1445,8 @@ def channel(portalId, channelId):
     # set the actual name later when channel metadata is available.
     channelName = portal.get("custom channel names", {}).get(channelId)
     # ----------------------------------------------------------------
-    ...
-    if not web:
-        logger.info(
-            "Portal({}):Channel({}) is not working. Looking for fallbacks...".format(
-                portalId, channelId
-            )
-        )
 
-        portals = getPortals()
-        for portal in portals:
-            if portals[portal]["enabled"] == "true":
-                fallbackChannels = portals[portal].get("fallback channels", {})
-                # only check membership if channelName is set
-                if channelName and channelName in fallbackChannels.values():
-                    # existing fallback logic unchanged
+    if not web:
         logger.info(
             "IP({}) requested Portal({}):Channel({})".format(ip, portalId, channelId)
         )
@@ -1073,85 +1454,89 @@ def channel(portalId, channelId):
     freeMac = False
 
     for mac in macs:
-        channels = None
-        cmd = None
-        link = None
-        if streamsPerMac == 0 or isMacFree():
-            logger.info(
-                "Trying Portal({}):MAC({}):Channel({})".format(portalId, mac, channelId)
-            )
-            freeMac = True
-            token = stb.getToken(url, mac, proxy)
-            if token:
-                stb.getProfile(url, mac, token, proxy)
-                channels = stb.getAllChannels(url, mac, token, proxy)
+        # A cached token may have expired on the portal; give the MAC one more
+        # try with a fresh handshake before treating it as broken
+        for attempt in range(2):
+            fromCache = False
+            channels = None
+            cmd = None
+            link = None
+            if streamsPerMac == 0 or isMacFree():
+                logger.info(
+                    "Trying Portal({}):MAC({}):Channel({})".format(portalId, mac, channelId)
+                )
+                freeMac = True
+                fromCache = hasPortalSnapshot(url, mac, proxy)
+                token, channels, _, channelsById = getPortalSnapshot(
+                    url, mac, proxy, withGenres=False
+                )
 
-        if channels:
-            for c in channels:
-                if str(c["id"]) == channelId:
+            if channels:
+                c = channelsById.get(channelId)
+                if c:
                     channelName = portal.get("custom channel names", {}).get(channelId)
                     if channelName == None:
                         channelName = c["name"]
                     cmd = c["cmd"]
-                    break
-
-        if cmd:
-            if "http://localhost/" in cmd:
-                link = stb.getLink(url, mac, token, cmd, proxy)
-            else:
-                link = cmd.split(" ")[1]
-
-        if link:
-            if getSettings().get("test streams", "true") == "false" or testStream():
-                if web:
-                    ffmpegcmd = [
-                        ffmpeg_path,
-                        "-loglevel",
-                        "panic",
-                        "-hide_banner",
-                        "-i",
-                        link,
-                        "-vcodec",
-                        "copy",
-                        "-f",
-                        "mp4",
-                        "-movflags",
-                        "frag_keyframe+empty_moov",
-                        "pipe:",
-                    ]
-                    if proxy:
-                        ffmpegcmd.insert(1, "-http_proxy")
-                        ffmpegcmd.insert(2, proxy)
-                    return Response(streamData(), mimetype="application/octet-stream")
 
+            if cmd:
+                if "http://localhost/" in cmd:
+                    link = stb.getLink(url, mac, token, cmd, proxy)
                 else:
-                    if getSettings().get("stream method", "ffmpeg") == "ffmpeg":
-                        ffmpegcmd = f"{ffmpeg_path} {getSettings()['ffmpeg command']}"
-                        ffmpegcmd = ffmpegcmd.replace("<url>", link)
-                        ffmpegcmd = ffmpegcmd.replace(
-                            "<timeout>",
-                            str(int(getSettings()["ffmpeg timeout"]) * int(1000000)),
-                        )
+                    link = cmd.split(" ")[1]
+
+            if link:
+                if settings.get("test streams", "true") == "false" or testStream():
+                    if web:
+                        ffmpegcmd = [
+                            ffmpeg_path,
+                            "-loglevel",
+                            "panic",
+                            "-hide_banner",
+                            "-i",
+                            link,
+                            "-vcodec",
+                            "copy",
+                            "-f",
+                            "mp4",
+                            "-movflags",
+                            "frag_keyframe+empty_moov",
+                            "pipe:",
+                        ]
                         if proxy:
-                            ffmpegcmd = ffmpegcmd.replace("<proxy>", proxy)
-                        else:
-                            ffmpegcmd = ffmpegcmd.replace("-http_proxy <proxy>", "")
-                        " ".join(ffmpegcmd.split())  # cleans up multiple whitespaces
-                        ffmpegcmd = ffmpegcmd.split()
+                            ffmpegcmd.insert(1, "-http_proxy")
+                            ffmpegcmd.insert(2, proxy)
                         return Response(
-                            streamData(), mimetype="application/octet-stream"
+                            streamData(), mimetype="video/mp4", direct_passthrough=True
                         )
-                    else:
-                        logger.info("Redirect sent")
-                        return redirect(link)
 
+                    else:
+                        if settings.get("stream method", "ffmpeg") == "ffmpeg":
+                            ffmpegcmd = build_ffmpeg_cmd(link, proxy, ffmpegTimeout)
+                            return Response(
+                                streamData(), mimetype="application/octet-stream"
+                            )
+                        else:
+                            logger.info("Redirect sent")
+                            return redirect(link)
+
+            if channels:
+                # Don't let the next zap reuse a token or channel list that just failed
+                evictPortalSnapshot(url, mac, proxy)
+            if not (attempt == 0 and fromCache and channels):
+                break
+            logger.info(
+                "Retrying Portal({}) using MAC({}) with a fresh token".format(
+                    portalId, mac
+                )
+            )
         logger.info(
             "Unable to connect to Portal({}) using MAC({})".format(portalId, mac)
         )
         logger.info("Moving MAC({}) for Portal({})".format(mac, portalName))
         moveMac(portalId, mac)
 
-        if not getSettings().get("try all macs", "true") == "true":
+        if not settings.get("try all macs", "true") == "true":
             break
 
     if not web:
@@ -1161,100 +1546,60 @@ def channel(portalId, channelId):
             )
         )
 
-        portals = getPortals()
-        for portal in portals:
-            if portals[portal]["enabled"] == "true":
-                fallbackChannels = portals[portal]["fallback channels"]
-                if channelName in fallbackChannels.values():
-                    url = portals[portal].get("url")
-                    macs = list(portals[portal]["macs"].keys())
-                    proxy = portals[portal].get("proxy")
-                    for mac in macs:
-                        channels = None
-                        cmd = None
-                        link = None
-                        if streamsPerMac == 0 or isMacFree():
-                            for k, v in fallbackChannels.items():
-                                if v == channelName:
-                                    try:
-                                        token = stb.getToken(url, mac, proxy)
-                                        stb.getProfile(url, mac, token, proxy)
-                                        channels = stb.getAllChannels(
-                                            url, mac, token, proxy
-                                        )
-                                    except:
+        for fPortalId, fChannelId in getFallbackIndex().get(channelName, []):
+            fPortal = portals[fPortalId]
+            url = fPortal.get("url")
+            macs = list(fPortal["macs"].keys())
+            proxy = fPortal.get("proxy")
+            for mac in macs:
+                for attempt in range(2):
+                    fromCache = False
+                    channels = None
+                    cmd = None
+                    link = None
+                    if streamsPerMac == 0 or isMacFree():
+                        fromCache = hasPortalSnapshot(url, mac, proxy)
+                        try:
+                            token, channels, _, channelsById = getPortalSnapshot(
+                                url, mac, proxy, withGenres=False
+                            )
+                        except:
+                            logger.info(
+                                "Unable to connect to fallback Portal({}) using MAC({})".format(
+                                    portalId, mac
+                                )
+                            )
+                        if channels:
+                            c = channelsById.get(fChannelId)
+                            if c:
+                                cmd = c["cmd"]
+                            if cmd:
+                                if "http://localhost/" in cmd:
+                                    link = stb.getLink(url, mac, token, cmd, proxy)
+                                else:
+                                    link = cmd.split(" ")[1]
+                                if link:
+                                    if testStream():
                                         logger.info(
-                                            "Unable to connect to fallback Portal({}) using MAC({})".format(
-                                                portalId, mac
+                                            "Fallback found for Portal({}):Channel({})".format(
+                                                portalId, channelId
                                             )
                                         )
-                                    if channels:
-                                        fChannelId = k
-                                        for c in channels:
-                                            if str(c["id"]) == fChannelId:
-                                                cmd = c["cmd"]
-                                                break
-                                        if cmd:
-                                            if "http://localhost/" in cmd:
-                                                link = stb.getLink(
-                                                    url, mac, token, cmd, proxy
-                                                )
-                                            else:
-                                                link = cmd.split(" ")[1]
-                                            if link:
-                                                if testStream():
-                                                    logger.info(
-                                                        "Fallback found for Portal({}):Channel({})".format(
-                                                            portalId, channelId
-                                                        )
-                                                    )
-                                                    if (
-                                                        getSettings().get(
-                                                            "stream method", "ffmpeg"
-                                                        )
-                                                        == "ffmpeg"
-                                                    ):
-                                                        ffmpegcmd = ffmpeg_path + " " + str(
-                                                            getSettings()[
-                                                                "ffmpeg command"
-                                                            ]
-                                                        )
-                                                        ffmpegcmd = ffmpegcmd.replace(
-                                                            "<url>", link
-                                                        )
-                                                        ffmpegcmd = ffmpegcmd.replace(
-                                                            "<timeout>",
-                                                            str(
-                                                                int(
-                                                                    getSettings()[
-                                                                        "ffmpeg timeout"
-                                                                    ]
-                                                                )
-                                                                * int(1000000)
-                                                            ),
-                                                        )
-                                                        if proxy:
-                                                            ffmpegcmd = (
-                                                                ffmpegcmd.replace(
-                                                                    "<proxy>", proxy
-                                                                )
-                                                            )
-                                                        else:
-                                                            ffmpegcmd = ffmpegcmd.replace(
-                                                                "-http_proxy <proxy>",
-                                                                "",
-                                                            )
-                                                        " ".join(
-                                                            ffmpegcmd.split()
-                                                        )  # cleans up multiple whitespaces
-                                                        ffmpegcmd = ffmpegcmd.split()
-                                                        return Response(
-                                                            streamData(),
-                                                            mimetype="application/octet-stream",
-                                                        )
-                                                    else:
-                                                        logger.info("Redirect sent")
-                                                        return redirect(link)
+                                        if settings.get("stream method", "ffmpeg") == "ffmpeg":
+                                            ffmpegcmd = build_ffmpeg_cmd(
+                                                link, proxy, ffmpegTimeout
+                                            )
+                                            return Response(
+                                                streamData(),
+                                                mimetype="application/octet-stream",
+                                            )
+                                        else:
+                                            logger.info("Redirect sent")
+                                            return redirect(link)
+                        if channels:
+                            evictPortalSnapshot(url, mac, proxy)
+                    if not (attempt == 0 and fromCache and channels):
+                        break
 
     if freeMac:
         logger.info(
@@ -1279,7 +1624,9 @@ def dashboard():
 @app.route("/streaming")
 @authorise
 def streaming():
-    return flask.jsonify(occupied)
+    with occupied_lock:
+        streams = {portal: list(sessions.values()) for portal, sessions in occupied.items()}
+    return flask.jsonify(streams)
 
 
 @app.route("/log")
@@ -1294,11 +1641,24 @@ def log():
     # Ensure the subdirectory exists
     os.makedirs(os.path.dirname(logFilePath), exist_ok=True)
 
-    # Open and read the log file
-    with open(logFilePath) as f:
+    # ?full=1 sends the whole file from disk without loading it into memory
+    if request.args.get("full") == "1":
+        return send_file(logFilePath, mimetype="text/plain", conditional=True)
+
+    # Otherwise only the last ?tail= bytes (512 KB by default)
+    tail = max(0, request.args.get("tail", LOG_TAIL_BYTES, type=int))
+    size = os.path.getsize(logFilePath) if os.path.exists(logFilePath) else 0
+    if not size:
+        return Response(b"", mimetype="text/plain")
+    with open(logFilePath, "rb") as f:
+        start = max(0, size - tail)
+        f.seek(start)
         log_content = f.read()
-    
-    return log_content
+    if start:
+        # Drop the partial first line
+        log_content = log_content.partition(b"\n")[2]
+
+    return Response(log_content, mimetype="text/plain")
 
 
 # HD Homerun #
@@ -1308,13 +1668,10 @@ def hdhr(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         auth = request.authorization
-        settings = getSettings()
-        security = settings["enable security"]
-        username = settings["username"]
-        password = settings["password"]
-        hdhrenabled = settings["enable hdhr"]
+        security, username, password = getCredentials()
+        hdhrenabled = getSettings()["enable hdhr"]
         if (
-            security == "false"
+            not security
             or auth
             and auth.username == username
             and auth.password == password
@@ -1365,53 +1722,65 @@ def status():
 def refresh_lineup():
     global cached_lineup
     logger.info("Refreshing Lineup...")
+    def fetch_portal(portal):
+        enabledChannels = set(portals[portal].get("enabled channels", []))
+        name = portals[portal]["name"]
+        url = portals[portal]["url"]
+        macs = list(portals[portal]["macs"].keys())
+        proxy = portals[portal]["proxy"]
+        customChannelNames = portals[portal].get("custom channel names", {})
+        customChannelNumbers = portals[portal].get("custom channel numbers", {})
+
+        allChannels = None
+        for mac in macs:
+            try:
+                token, allChannels, _, _ = getPortalSnapshot(url, mac, proxy, withGenres=False)
+                break
+            except:
+                allChannels = None
+
+        if not allChannels:
+            logger.error("Error making lineup for {}, skipping".format(name))
+            return []
+
+        entries = []
+        for channel in allChannels:
+            channelId = str(channel.get("id"))
+            if channelId in enabledChannels:
+                channelName = customChannelNames.get(channelId)
+                if channelName is None:
+                    channelName = str(channel.get("name"))
+                channelNumber = customChannelNumbers.get(channelId)
+                if channelNumber is None:
+                    channelNumber = str(channel.get("number"))
+
+                entries.append(
+                    {
+                        "GuideNumber": channelNumber,
+                        "GuideName": channelName,
+                        "URL": "http://"
+                        + host
+                        + "/play/"
+                        + portal
+                        + "/"
+                        + channelId,
+                    }
+                )
+        return entries
+
     lineup = []
     portals = getPortals()
-    for portal in portals:
-        if portals[portal]["enabled"] == "true":
-            enabledChannels = portals[portal].get("enabled channels", [])
-            if len(enabledChannels) != 0:
-                name = portals[portal]["name"]
-                url = portals[portal]["url"]
-                macs = list(portals[portal]["macs"].keys())
-                proxy = portals[portal]["proxy"]
-                customChannelNames = portals[portal].get("custom channel names", {})
-                customChannelNumbers = portals[portal].get("custom channel numbers", {})
-
-                for mac in macs:
-                    try:
-                        token = stb.getToken(url, mac, proxy)
-                        stb.getProfile(url, mac, token, proxy)
-                        allChannels = stb.getAllChannels(url, mac, token, proxy)
-                        break
-                    except:
-                        allChannels = None
-
-                if allChannels:
-                    for channel in allChannels:
-                        channelId = str(channel.get("id"))
-                        if channelId in enabledChannels:
-                            channelName = customChannelNames.get(channelId)
-                            if channelName is None:
-                                channelName = str(channel.get("name"))
-                            channelNumber = customChannelNumbers.get(channelId)
-                            if channelNumber is None:
-                                channelNumber = str(channel.get("number"))
-
-                            lineup.append(
-                                {
-                                    "GuideNumber": channelNumber,
-                                    "GuideName": channelName,
-                                    "URL": "http://"
-                                    + host
-                                    + "/play/"
-                                    + portal
-                                    + "/"
-                                    + channelId,
-                                }
-                            )
-                else:
-                    logger.error("Error making lineup for {}, skipping".format(name))
+    activePortals = [
+        p
+        for p in portals
+        if portals[p]["enabled"] == "true"
+        and len(portals[p].get("enabled channels", [])) != 0
+    ]
+
+    # Fetch every portal concurrently; results keep the portal order
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(activePortals)))) as ex:
+        for entries in ex.map(fetch_portal, activePortals):
+            lineup.extend(entries)
     
     # Sort lineup by GuideNumber
     lineup.sort(key=lambda x: int(x["GuideNumber"]))
@@ -1437,20 +1806,40 @@ def refresh_lineup_endpoint():
     refresh_lineup()
     return jsonify({"status": "Lineup refreshed successfully"})
 
+def runEvery(seconds, job):
+    # Simple interval scheduler for the background refresh threads
+    while True:
+        time.sleep(seconds)
+        try:
+            job()
+        except Exception as e:
+            logger.error(f"Scheduled {job.__name__} failed: {e}")
+
+
 def start_refresh():
     # Run refresh_lineup in a separate thread
     threading.Thread(target=refresh_lineup, daemon=True).start()
     threading.Thread(target=refresh_xmltv, daemon=True).start()
+    # Then keep the guide and lineup warm so requests never wait on a refresh
+    threading.Thread(target=runEvery, args=(900, refresh_xmltv), daemon=True).start()
+    threading.Thread(target=runEvery, args=(3600, refresh_lineup), daemon=True).start()
     
     
 if __name__ == "__main__":
     config = loadConfig()
 
+    # Save config changes in the background, and anything still pending on exit
+    threading.Thread(target=configWriter, daemon=True).start()
+    atexit.register(flushConfig)
+
     # Start the refresh thread before the server
     start_refresh()
 
     # Start the server
     if "TERM_PROGRAM" in os.environ.keys() and os.environ["TERM_PROGRAM"] == "vscode":
         app.run(host="0.0.0.0", port=8001, debug=True)
+    elif useGevent:
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(("0.0.0.0", 8001), app, log=None).serve_forever()
     else:
         waitress.serve(app, port=8001, _quiet=True, threads=24)
@@ -1,12 +1,19 @@
 # stb.py
 import logging
 import re
-from typing import Any, Dict, List, Optional
-from urllib.parse import urlparse
-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import orjson
 import requests
 from requests.adapters import HTTPAdapter, Retry
-from requests.exceptions import RequestException, JSONDecodeError
+from requests.exceptions import RequestException
 
 # Logger konfigurieren (Aufrufender Code kann Level ändern)
 logger = logging.getLogger(__name__)
@@ -25,32 +32,93 @@ retries = Retry(
     status_forcelist=[500, 502, 503, 504],
     allowed_methods=frozenset(["GET"]),
 )
-s.mount("http://", HTTPAdapter(max_retries=retries))
-s.mount("https://", HTTPAdapter(max_retries=retries))
+# Ein Adapter für beide Schemata; der Pool hält bis zu 64 Hosts mit je bis zu
+# 64 Keep-Alive-Verbindungen, damit parallele Abrufe aus app.py wiederverwendet werden
+adapter = HTTPAdapter(
+    pool_connections=64, pool_maxsize=64, pool_block=False, max_retries=retries
+)
+s.mount("http://", adapter)
+s.mount("https://", adapter)
 
 DEFAULT_TIMEOUT = 5.0  # Sekunden
 
-def _build_headers(token: Optional[str] = None) -> Dict[str, str]:
+# Schema und Host einer Portal-URL, z. B. "http://host:8080"
+_URL_RE = re.compile(r"^(https?://[^/?#]+)", re.IGNORECASE)
+
+# Vorkompilierte Muster für das Parsen von xpcom.common.js
+_VAR_PATTERN_RE = re.compile(r"varpattern.*\/(\(http.*)\/;")
+_PROTOCOL_IDX_RE = re.compile(r"this\.portal_protocol.*(\d).*;")
+_IP_IDX_RE = re.compile(r"this\.portal_ip.*(\d).*;")
+_PATH_IDX_RE = re.compile(r"this\.portal_path.*(\d).*;")
+_AJAX_LOADER_RE = re.compile(r"this\.ajax_loader=(.*\.php);")
+_PORTAL_TOKEN_RE = re.compile(r"this\.portal_(protocol|ip|path)")
+# Leerzeichen, Hochkommas und Pluszeichen in einem Durchlauf entfernen
+_JS_STRIP_TABLE = str.maketrans("", "", " '+")
+
+# Feste Query-Strings der Portal-API (an die Portal-URL angehängt)
+_HANDSHAKE_Q = "?type=stb&action=handshake&JsHttpRequest=1-xml"
+_PROFILE_Q = "?type=stb&action=get_profile&JsHttpRequest=1-xml"
+_MAIN_INFO_Q = "?type=account_info&action=get_main_info&JsHttpRequest=1-xml"
+_ALL_CHANNELS_Q = "?type=itv&action=get_all_channels&force_ch_link_check=&JsHttpRequest=1-xml"
+_GENRES_Q = "?action=get_genres&type=itv&JsHttpRequest=1-xml"
+_EPG_TPL = "?type=itv&action=get_epg_info&period={}&JsHttpRequest=1-xml"
+_LINK_TPL = (
+    "?type=itv&action=create_link&cmd={}"
+    "&series=0&forced_storage=false&disable_ad=false&download=false&force_ch_link_check=false&JsHttpRequest=1-xml"
+)
+
+# Genre-Listen ändern sich praktisch nie; pro (url, mac) eine Stunde zwischenspeichern.
+# Token, Kanäle usw. cached bereits app.py (getPortalSnapshot).
+GENRES_TTL = 3600  # Sekunden
+_genres_cache: Dict[Any, Any] = {}
+_cache_lock = threading.RLock()
+
+# Header und Cookies werden pro Token/MAC nur einmal gebaut und als schreibgeschützte
+# Mappings wiederverwendet -- Aufrufer dürfen sie nicht verändern
+@lru_cache(maxsize=2048)
+def _build_headers(token: Optional[str] = None) -> Mapping[str, str]:
     headers = {"User-Agent": "Mozilla/5.0 (QtEmbedded; U; Linux; C)"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
-    return headers
+    return MappingProxyType(headers)
+
+# Standard-Header (User-Agent) auch an der Session setzen, damit jede Anfrage ihn trägt
+s.headers.update(_build_headers())
 
-def _build_cookies(mac: str) -> Dict[str, str]:
+@lru_cache(maxsize=4096)
+def _build_cookies(mac: str) -> Mapping[str, str]:
     # timezone und Sprache sind hartcodiert wie im Original
-    return {"mac": mac, "stb_lang": "en", "timezone": "Europe/London"}
+    return MappingProxyType({"mac": mac, "stb_lang": "en", "timezone": "Europe/London"})
 
 def _request_get(
-    url: str, *, proxies: Optional[Dict[str, str]] = None, **kwargs
+    url: str,
+    cookies: Optional[Mapping[str, str]] = None,
+    headers: Optional[Mapping[str, str]] = None,
+    proxies: Optional[Dict[str, str]] = None,
 ) -> Optional[requests.Response]:
     try:
-        resp = s.get(url, proxies=proxies or None, timeout=DEFAULT_TIMEOUT, **kwargs)
-        resp.raise_for_status()
+        resp = s.get(
+            url, cookies=cookies, headers=headers, proxies=proxies or None, timeout=DEFAULT_TIMEOUT
+        )
+        if not resp.ok:
+            # Statuscode direkt prüfen statt raise_for_status(); 5xx hat der
+            # Retry-Adapter zu diesem Zeitpunkt schon wiederholt
+            logger.debug("HTTP GET %s lieferte Status %s", url, resp.status_code)
+            return None
         return resp
     except RequestException as e:
         logger.debug("HTTP GET failed for %s: %s", url, e)
         return None
 
+def _json(resp: requests.Response) -> Any:
+    # orjson parst die rohen Bytes direkt, ohne Umweg über resp.text
+    return orjson.loads(resp.content)
+
+def _js_get(resp: requests.Response, key: str) -> Any:
+    # Feld aus dem "js"-Objekt; None, wenn "js" fehlt, null oder kein Objekt ist
+    js = _json(resp).get("js")
+    return js.get(key) if isinstance(js, dict) else None
+
 def getUrl(target_url: str, proxy: Optional[str] = None) -> Optional[str]:
     """
     Versucht die xpcom.common.js / ähnliche Dateien auf dem Portal zu laden und
@@ -60,8 +128,8 @@ def getUrl(target_url: str, proxy: Optional[str] = None) -> Optional[str]:
     def parse_response(requested_url: str, response: requests.Response) -> Optional[str]:
         try:
             # Minimiere Format-Noise ähnlich wie im Original, aber sicherer behandeln
-            java = response.text.replace(" ", "").replace("'", "").replace("+", "")
-            m_pattern = re.search(r"varpattern.*\/(\(http.*)\/;", java)
+            java = response.text.translate(_JS_STRIP_TABLE)
+            m_pattern = _VAR_PATTERN_RE.search(java)
             if not m_pattern:
                 logger.debug("Kein varpattern gefunden in %s", requested_url)
                 return None
@@ -71,8 +139,8 @@ def getUrl(target_url: str, proxy: Optional[str] = None) -> Optional[str]:
                 logger.debug("Pattern '%s' passt nicht auf '%s'", pattern, requested_url)
                 return None
 
-            def find_group_int(expr: str) -> Optional[int]:
-                m = re.search(expr, java)
+            def find_group_int(expr: re.Pattern) -> Optional[int]:
+                m = expr.search(java)
                 if not m:
                     return None
                 try:
@@ -80,9 +148,9 @@ def getUrl(target_url: str, proxy: Optional[str] = None) -> Optional[str]:
                 except (IndexError, ValueError):
                     return None
 
-            protocolIndex = find_group_int(r"this\.portal_protocol.*(\d).*;")
-            ipIndex = find_group_int(r"this\.portal_ip.*(\d).*;")
-            pathIndex = find_group_int(r"this\.portal_path.*(\d).*;")
+            protocolIndex = find_group_int(_PROTOCOL_IDX_RE)
+            ipIndex = find_group_int(_IP_IDX_RE)
+            pathIndex = find_group_int(_PATH_IDX_RE)
             if None in (protocolIndex, ipIndex, pathIndex):
                 logger.debug("Fehlende Index-Angaben im JS (protocol/ip/path)")
                 return None
@@ -95,27 +163,24 @@ def getUrl(target_url: str, proxy: Optional[str] = None) -> Optional[str]:
                 logger.debug("Index-Extraktion aus Regex-Ergebnis ist fehlgeschlagen")
                 return None
 
-            portal_pattern_m = re.search(r"this\.ajax_loader=(.*\.php);", java)
+            portal_pattern_m = _AJAX_LOADER_RE.search(java)
             if not portal_pattern_m:
                 logger.debug("Kein ajax_loader pattern gefunden")
                 return None
             portal_pattern = portal_pattern_m.group(1)
 
-            portal = (
-                portal_pattern.replace("this.portal_protocol", protocol)
-                .replace("this.portal_ip", ip)
-                .replace("this.portal_path", path)
-            )
+            mapping = {"protocol": protocol, "ip": ip, "path": path}
+            portal = _PORTAL_TOKEN_RE.sub(lambda m: mapping[m.group(1)], portal_pattern)
             return portal
         except Exception as e:
             logger.exception("Fehler beim Parsen der Antwort von %s: %s", requested_url, e)
             return None
 
-    parsed = urlparse(target_url)
-    if not parsed.scheme or not parsed.netloc:
+    m_base = _URL_RE.match(target_url)
+    if not m_base:
         logger.debug("Ungültige URL: %s", target_url)
         return None
-    base = f"{parsed.scheme}://{parsed.netloc}"
+    base = m_base.group(1)
 
     candidate_paths = [
         "/c/xpcom.common.js",
@@ -128,156 +193,204 @@ def getUrl(target_url: str, proxy: Optional[str] = None) -> Optional[str]:
     proxies = {"http": proxy, "https": proxy} if proxy else None
     headers = _build_headers()
 
-    # Versuche mit Proxy (falls vorhanden) bzw. ohne Proxy
-    for try_proxies in (proxies, None):
-        for p in candidate_paths:
-            url = base + p
-            resp = _request_get(url, headers=headers) if try_proxies is None else _request_get(url, headers=headers, proxies=try_proxies)
-            if resp:
-                portal = parse_response(url, resp)
-                if portal:
-                    logger.info("Portal gefunden: %s", portal)
-                    return portal
+    # Erst alle Kandidaten über den Proxy (falls vorhanden), nur wenn keiner passt
+    # direkt -- innerhalb eines Durchgangs parallel, die erste erfolgreich
+    # geparste Antwort gewinnt
+    proxy_modes = (proxies, None) if proxies else (None,)
+    executor = ThreadPoolExecutor(max_workers=len(candidate_paths))
+    try:
+        for try_proxies in proxy_modes:
+            futures = {
+                executor.submit(_request_get, base + p, headers=headers, proxies=try_proxies): base + p
+                for p in candidate_paths
+            }
+            for future in as_completed(futures):
+                resp = future.result()
+                if resp:
+                    url = futures[future]
+                    portal = parse_response(url, resp)
+                    if portal:
+                        logger.info("Portal gefunden: %s", portal)
+                        return portal
+    finally:
+        # Restliche Proben nicht abwarten
+        executor.shutdown(wait=False, cancel_futures=True)
     logger.debug("Kein passendes xpcom.common.js gefunden für %s", target_url)
     return None
 
-def getToken(url: str, mac: str, proxy: Optional[str] = None) -> Optional[str]:
+@dataclass
+class StbClient:
     """
-    Führt Handshake aus und gibt token zurück oder None.
+    Bündelt url, MAC, Token und Proxy einer Portal-Sitzung. Header, Cookies und
+    Proxies werden einmal beim Anlegen gebaut statt bei jedem Aufruf.
+    Ohne Token kann nur getToken() (Handshake) sinnvoll aufgerufen werden.
     """
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers()
-
-    full_url = f"{url}?type=stb&action=handshake&JsHttpRequest=1-xml"
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
+    url: str
+    mac: str
+    token: Optional[str] = None
+    proxy: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        self._headers = _build_headers(self.token)
+        self._cookies = _build_cookies(self.mac)
+        self._proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
+
+    def _get(self, query: str) -> Optional[requests.Response]:
+        return _request_get(
+            self.url + query, cookies=self._cookies, headers=self._headers, proxies=self._proxies
+        )
+
+    def getToken(self) -> Optional[str]:
+        """
+        Führt Handshake aus und gibt token zurück oder None.
+        """
+        resp = self._get(_HANDSHAKE_Q)
+        if not resp:
+            return None
+        try:
+            token = _js_get(resp, "token")
+            if token:
+                return token
+        except (ValueError, orjson.JSONDecodeError) as e:
+            logger.debug("JSON-Decode-Fehler in getToken: %s", e)
         return None
-    try:
-        token = resp.json().get("js", {}).get("token")
-        if token:
-            return token
-    except (ValueError, JSONDecodeError) as e:
-        logger.debug("JSON-Decode-Fehler in getToken: %s", e)
-    return None
 
-def getProfile(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers(token)
+    def getProfile(self) -> Optional[Dict[str, Any]]:
+        resp = self._get(_PROFILE_Q)
+        if not resp:
+            return None
+        try:
+            profile = _json(resp).get("js")
+            return profile
+        except (ValueError, orjson.JSONDecodeError) as e:
+            logger.debug("JSON-Decode-Fehler in getProfile: %s", e)
+            return None
 
-    full_url = f"{url}?type=stb&action=get_profile&JsHttpRequest=1-xml"
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
-        return None
-    try:
-        profile = resp.json().get("js")
-        return profile
-    except (ValueError, JSONDecodeError) as e:
-        logger.debug("JSON-Decode-Fehler in getProfile: %s", e)
-        return None
+    def getExpires(self) -> Optional[Any]:
+        """
+        Liefert (wie im Original) den Wert response.json()['js']['phone'] zurück -- das Feld
+        'expires' war im Original nicht vorhanden; prüfen ob dies korrekt ist.
+        """
+        resp = self._get(_MAIN_INFO_Q)
+        if not resp:
+            return None
+        try:
+            return _js_get(resp, "phone")
+        except (ValueError, orjson.JSONDecodeError) as e:
+            logger.debug("JSON-Decode-Fehler in getExpires: %s", e)
+            return None
 
-def getExpires(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[Any]:
+    def getAllChannels(self) -> Optional[List[Dict[str, Any]]]:
+        resp = self._get(_ALL_CHANNELS_Q)
+        if not resp:
+            return None
+        try:
+            return _js_get(resp, "data")
+        except (ValueError, orjson.JSONDecodeError) as e:
+            logger.debug("JSON-Decode-Fehler in getAllChannels: %s", e)
+            return None
+
+    def getGenres(self) -> Optional[List[Dict[str, Any]]]:
+        key = (self.url, self.mac)
+        with _cache_lock:
+            cached = _genres_cache.get(key)
+        if cached and time.monotonic() - cached[0] < GENRES_TTL:
+            return cached[1]
+
+        resp = self._get(_GENRES_Q)
+        if not resp:
+            return None
+        try:
+            genres = _json(resp).get("js")
+        except (ValueError, orjson.JSONDecodeError) as e:
+            logger.debug("JSON-Decode-Fehler in getGenres: %s", e)
+            return None
+        if genres:
+            with _cache_lock:
+                _genres_cache[key] = (time.monotonic(), genres)
+        return genres
+
+    def getGenreNames(self) -> Optional[Dict[str, str]]:
+        """
+        None, wenn die Genres nicht abgerufen werden konnten; ein leeres Dict,
+        wenn das Portal schlicht keine Genres hat.
+        """
+        genre_data = self.getGenres()
+        if genre_data is None:
+            return None
+        try:
+            return {
+                str(gid): name
+                for i in genre_data
+                if (gid := i.get("id")) is not None and (name := i.get("title")) is not None
+            }
+        except Exception as e:
+            logger.debug("Fehler beim Aufbau von Genre-Namen: %s", e)
+            return None
+
+    def getLink(self, cmd: str) -> Optional[str]:
+        resp = self._get(_LINK_TPL.format(quote(cmd, safe="")))
+        if not resp:
+            return None
+        try:
+            # Original: data["js"]["cmd"].split()[-1]
+            cmd_field = _js_get(resp, "cmd")
+            if not cmd_field:
+                return None
+            # Nur das letzte Token abtrennen statt alle zu splitten
+            link = cmd_field.rsplit(None, 1)[-1]
+            return link
+        except (ValueError, orjson.JSONDecodeError, AttributeError, IndexError) as e:
+            logger.debug("Fehler beim Parsen des Links: %s", e)
+            return None
+
+    def getEpg(self, period: int) -> Optional[List[Dict[str, Any]]]:
+        resp = self._get(_EPG_TPL.format(period))
+        if not resp:
+            return None
+        try:
+            return _js_get(resp, "data")
+        except (ValueError, orjson.JSONDecodeError) as e:
+            logger.debug("JSON-Decode-Fehler in getEpg: %s", e)
+            return None
+
+def getAccountInfo(url: str, mac: str, proxy: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[Any]]:
     """
-    Liefert (wie im Original) den Wert response.json()['js']['phone'] zurück -- das Feld
-    'expires' war im Original nicht vorhanden; prüfen ob dies korrekt ist.
+    Handshake, Profil und Ablaufdatum für eine MAC über einen gemeinsamen Client.
+    Die Reihenfolge bleibt strikt: manche Portale aktivieren die Sitzung erst mit
+    get_profile und liefern vorher keine Account-Infos.
+    Gibt (token, profile, expires) zurück; ohne Token (None, None, None).
     """
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers(token)
+    token = getToken(url, mac, proxy)
+    if not token:
+        return None, None, None
+    client = StbClient(url, mac, token, proxy)
+    profile = client.getProfile()
+    expires = client.getExpires()
+    return token, profile, expires
 
-    full_url = f"{url}?type=account_info&action=get_main_info&JsHttpRequest=1-xml"
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
-        return None
-    try:
-        return resp.json().get("js", {}).get("phone")
-    except (ValueError, JSONDecodeError) as e:
-        logger.debug("JSON-Decode-Fehler in getExpires: %s", e)
-        return None
+# Bisherige Funktions-API als dünne Wrapper um StbClient
 
-def getAllChannels(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers(token)
+def getToken(url: str, mac: str, proxy: Optional[str] = None) -> Optional[str]:
+    return StbClient(url, mac, proxy=proxy).getToken()
 
-    full_url = f"{url}?type=itv&action=get_all_channels&force_ch_link_check=&JsHttpRequest=1-xml"
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
-        return None
-    try:
-        return resp.json().get("js", {}).get("data")
-    except (ValueError, JSONDecodeError) as e:
-        logger.debug("JSON-Decode-Fehler in getAllChannels: %s", e)
-        return None
+def getProfile(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    return StbClient(url, mac, token, proxy).getProfile()
 
-def getGenres(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers(token)
+def getExpires(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[Any]:
+    return StbClient(url, mac, token, proxy).getExpires()
 
-    full_url = f"{url}?action=get_genres&type=itv&JsHttpRequest=1-xml"
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
-        return None
-    try:
-        return resp.json().get("js")
-    except (ValueError, JSONDecodeError) as e:
-        logger.debug("JSON-Decode-Fehler in getGenres: %s", e)
-        return None
+def getAllChannels(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    return StbClient(url, mac, token, proxy).getAllChannels()
+
+def getGenres(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    return StbClient(url, mac, token, proxy).getGenres()
 
 def getGenreNames(url: str, mac: str, token: str, proxy: Optional[str] = None) -> Optional[Dict[str, str]]:
-    genre_data = getGenres(url, mac, token, proxy)
-    if not genre_data:
-        return None
-    genres: Dict[str, str] = {}
-    try:
-        for i in genre_data:
-            gid = i.get("id")
-            name = i.get("title")
-            if gid is None or name is None:
-                continue
-            genres[str(gid)] = name
-        return genres if genres else None
-    except Exception as e:
-        logger.debug("Fehler beim Aufbau von Genre-Namen: %s", e)
-        return None
+    return StbClient(url, mac, token, proxy).getGenreNames()
 
 def getLink(url: str, mac: str, token: str, cmd: str, proxy: Optional[str] = None) -> Optional[str]:
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers(token)
-
-    full_url = (
-        f"{url}?type=itv&action=create_link&cmd={cmd}"
-        "&series=0&forced_storage=false&disable_ad=false&download=false&force_ch_link_check=false&JsHttpRequest=1-xml"
-    )
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
-        return None
-    try:
-        data = resp.json()
-        # Original: data["js"]["cmd"].split()[-1]
-        cmd_field = data.get("js", {}).get("cmd")
-        if not cmd_field:
-            return None
-        link = cmd_field.split()[-1]
-        return link
-    except (ValueError, JSONDecodeError, AttributeError, IndexError) as e:
-        logger.debug("Fehler beim Parsen des Links: %s", e)
-        return None
+    return StbClient(url, mac, token, proxy).getLink(cmd)
 
 def getEpg(url: str, mac: str, token: str, period: int, proxy: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
-    proxies = {"http": proxy, "https": proxy} if proxy else None
-    cookies = _build_cookies(mac)
-    headers = _build_headers(token)
-
-    full_url = f"{url}?type=itv&action=get_epg_info&period={period}&JsHttpRequest=1-xml"
-    resp = _request_get(full_url, cookies=cookies, headers=headers, proxies=proxies)
-    if not resp:
-        return None
-    try:
-        return resp.json().get("js", {}).get("data")
-    except (ValueError, JSONDecodeError) as e:
-        logger.debug("JSON-Decode-Fehler in getEpg: %s", e)
-        return None
+    return StbClient(url, mac, token, proxy).getEpg(period)